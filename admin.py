@@ -0,0 +1,421 @@
+# admin.py
+# Админ-панель: CRUD категорий и курсов, профилировщик, бэкапы. Роутер импортируется
+# из Bot.py только если задан ADMIN_ID; детектор зависаний loop работает и без него (Bot.main).
+import asyncio
+import html
+import logging
+import time
+from contextlib import suppress
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.filters import Command, CommandObject, StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import StatesGroup, State
+from aiogram.types import Message, CallbackQuery, BufferedInputFile
+
+import backup
+import db
+import jobs
+import keyboards as kb
+import media
+import profiler
+from helpers import extract_int, is_admin
+
+logger = logging.getLogger(__name__)
+
+router = Router(name="admin")
+
+
+def setup(dp: Dispatcher) -> None:
+    dp.include_router(router)
+    dp.update.outer_middleware(profiler.UpdateCounter())
+
+
+# ---------- FSM States ----------
+class States:
+    class AddCategory(StatesGroup):
+        waiting_title = State()
+
+    class EditCategory(StatesGroup):
+        waiting_new_title = State()
+
+    class AddCourse(StatesGroup):
+        choosing_category = State()
+        waiting_title = State()
+        waiting_description = State()
+        waiting_price = State()
+        waiting_link = State()
+
+    class EditCourse(StatesGroup):
+        waiting_field_choice = State()
+        waiting_new_value = State()
+
+
+# ---------- Admin panel entry ----------
+@router.message(F.text == "⚙️ Админ-панель")
+async def admin_panel(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔ У вас нет доступа.")
+        return
+    await message.answer("⚙️ Админ-панель:", reply_markup=kb.reply_admin_menu())
+
+
+# ---------- Admin: runtime profiler ----------
+_profile_tasks: set = set()
+
+
+async def _run_profile(bot: Bot, chat_id: int, seconds: int | None, updates: int | None):
+    try:
+        report, raw = await profiler.profile(seconds=seconds, updates=updates)
+        await bot.send_message(chat_id, f"<pre>{html.escape(report[:3900])}</pre>")
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        await bot.send_document(chat_id, BufferedInputFile(raw, filename=f"profile-{stamp}.prof"))
+    except (RuntimeError, ValueError) as e:
+        await bot.send_message(chat_id, f"⚠️ {e}")
+    except Exception:
+        logger.exception("Profiling session failed")
+        with suppress(Exception):
+            await bot.send_message(chat_id, "Профилирование завершилось ошибкой — подробности в логах.")
+
+
+@router.message(F.text == "🩺 Профилировщик")
+@router.message(Command("profile"))
+async def admin_profile(message: Message, command: CommandObject | None = None):
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔ У вас нет доступа.")
+        return
+    if profiler.active_session() is not None:
+        await message.answer(f"Профилирование уже идёт ({profiler.active_session().describe()}).")
+        return
+    # /profile 30 — 30 секунд, /profile 200u — 200 апдейтов
+    arg = ((command and command.args) or "").strip().lower()
+    seconds, updates = profiler.PROFILE_SECONDS, None
+    if arg.endswith("u") and arg[:-1].isdigit():
+        seconds, updates = None, int(arg[:-1])
+    elif arg.isdigit():
+        seconds = min(int(arg), profiler.PROFILE_MAX_SECONDS)
+    elif arg:
+        await message.answer("Формат: /profile 30 (секунд) или /profile 200u (апдейтов)")
+        return
+    if seconds == 0 or updates == 0:
+        await message.answer("Нужно больше нуля: /profile 30 или /profile 200u")
+        return
+    task = asyncio.create_task(_run_profile(message.bot, message.chat.id, seconds, updates))
+    _profile_tasks.add(task)
+    task.add_done_callback(_profile_tasks.discard)
+    what = f"{updates} апдейтов" if updates else f"{seconds} с"
+    await message.answer(f"🩺 Профилирую {what}. Зависания loop: /stalls")
+
+
+@router.message(Command("stalls"))
+async def admin_stalls(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔ У вас нет доступа.")
+        return
+    await message.answer(f"<pre>{html.escape(profiler.format_stalls()[:3900])}</pre>")
+
+
+# ---------- Admin: backups ----------
+@router.message(Command("backup"))
+async def admin_backup(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔ У вас нет доступа.")
+        return
+    try:
+        stats = await backup.backup_once()
+    except Exception:
+        logger.exception("Manual backup failed")
+        await message.answer("Не удалось сделать бэкап — подробности в логах.")
+        return
+    await message.answer(html.escape(backup.format_stats(stats)))
+
+
+@router.message(Command("backups"))
+async def admin_backups(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔ У вас нет доступа.")
+        return
+    names = backup.list_snapshots()
+    if not names:
+        await message.answer("Снимков пока нет. /backup — сделать сейчас.")
+        return
+    listing = "\n".join(f"<code>{html.escape(n)}</code>" for n in reversed(names))
+    await message.answer(f"💾 Снимки (новые сверху):\n{listing}\n\nВосстановить: /restore имя")
+
+
+@router.message(Command("restore"))
+async def admin_restore(message: Message, command: CommandObject):
+    if not is_admin(message.from_user.id):
+        await message.answer("⛔ У вас нет доступа.")
+        return
+    name = (command.args or "").strip()
+    if not name:
+        await message.answer("Формат: /restore имя_снимка (список — /backups)")
+        return
+    try:
+        safety, counts = await backup.restore(name)
+    except ValueError as e:
+        await message.answer(html.escape(str(e)))
+        return
+    # индекс похожих курсов не восстанавливается — пересобираем под новый каталог
+    await jobs.enqueue("refresh_recommendations")
+    restored = ", ".join(f"{t}: {n}" for t, n in counts.items())
+    await message.answer(f"✅ Каталог восстановлен ({restored}).\nПрежнее состояние: <code>{html.escape(safety)}</code>")
+
+
+# ---------- Admin: Categories CRUD ----------
+@router.message(F.text == "➕ Добавить категорию")
+async def admin_add_category_start(message: Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        return
+    await state.set_state(States.AddCategory.waiting_title)
+    await message.answer("Введите название новой категории (или ❌ Отмена):", reply_markup=kb.cancel_kb())
+
+
+@router.message(StateFilter(States.AddCategory.waiting_title))
+async def admin_add_category_save(message: Message, state: FSMContext):
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Отменено.", reply_markup=kb.reply_admin_menu())
+        return
+    await db.add_category(message.text.strip())
+    await state.clear()
+    await message.answer("✅ Категория добавлена.", reply_markup=kb.reply_admin_menu())
+
+
+@router.message(F.text == "📂 Управление категориями" )
+async def admin_manage_categories(message: Message):
+    if not is_admin(message.from_user.id):
+        return
+    cats = await db.get_categories()
+    if not cats:
+        await message.answer("Категорий нет.", reply_markup=kb.reply_admin_menu())
+        return
+    await message.answer("Категории (редактирование/удаление):", reply_markup=kb.edit_delete_categories(cats))
+
+
+@router.callback_query(F.data.startswith("delete_category:"))
+async def admin_delete_category(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    cid = extract_int(callback.data)
+    if cid is None:
+        await callback.answer("Ошибка", show_alert=True)
+        return
+    # сама категория удаляется сразу, отвязка курсов — фоновой задачей
+    await db.delete_category(cid, detach_courses=False)
+    await jobs.enqueue("detach_category_courses", category_id=cid)
+    await callback.message.answer("Категория удалена.", reply_markup=kb.reply_admin_menu())
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("edit_category:"))
+async def admin_edit_category_start(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    cid = extract_int(callback.data)
+    if cid is None:
+        await callback.answer("Ошибка", show_alert=True)
+        return
+    await state.update_data(edit_category_id=cid)
+    await state.set_state(States.EditCategory.waiting_new_title)
+    await callback.message.answer("Введите новое название категории (или ❌ Отмена):", reply_markup=kb.cancel_kb())
+    await callback.answer()
+
+
+@router.message(StateFilter(States.EditCategory.waiting_new_title))
+async def admin_edit_category_save(message: Message, state: FSMContext):
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Отменено.", reply_markup=kb.reply_admin_menu())
+        return
+    data = await state.get_data()
+    cid = data.get("edit_category_id")
+    if cid is None:
+        await state.clear()
+        await message.answer("Нет выбранной категории.", reply_markup=kb.reply_admin_menu())
+        return
+    await db.update_category(cid, message.text.strip())
+    await state.clear()
+    await message.answer("Категория обновлена.", reply_markup=kb.reply_admin_menu())
+
+
+# ---------- Admin: Courses CRUD (add, list, edit, delete) ----------
+@router.message(F.text == "➕ Добавить курс")
+async def admin_add_course_start(message: Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        return
+    cats = await db.get_categories()
+    if not cats:
+        await message.answer("Сначала добавьте категорию.", reply_markup=kb.reply_admin_menu())
+        return
+    await state.set_state(States.AddCourse.choosing_category)
+    await message.answer("Выберите категорию для нового курса:", reply_markup=kb.categories_list(cats, for_add=True))
+
+
+@router.callback_query(StateFilter(States.AddCourse.choosing_category), F.data.startswith("catadd:"))
+async def admin_choose_category_for_course(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    cid = extract_int(callback.data)
+    if cid is None:
+        await callback.answer("Ошибка", show_alert=True)
+        return
+    await state.update_data(category_id=cid)
+    await state.set_state(States.AddCourse.waiting_title)
+    await callback.message.answer("Введите название курса (или ❌ Отмена):", reply_markup=kb.cancel_kb())
+    await callback.answer()
+
+
+@router.message(StateFilter(States.AddCourse.waiting_title))
+async def admin_add_course_title(message: Message, state: FSMContext):
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Отменено.", reply_markup=kb.reply_admin_menu())
+        return
+    await state.update_data(title=message.text.strip())
+    await state.set_state(States.AddCourse.waiting_description)
+    await message.answer("Введите описание курса (или ❌ Отмена):", reply_markup=kb.cancel_kb())
+
+
+@router.message(StateFilter(States.AddCourse.waiting_description))
+async def admin_add_course_description(message: Message, state: FSMContext):
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Отменено.", reply_markup=kb.reply_admin_menu())
+        return
+    await state.update_data(description=message.text.strip())
+    await state.set_state(States.AddCourse.waiting_price)
+    await message.answer("Введите цену курса в рублях (целое число) (или ❌ Отмена):", reply_markup=kb.cancel_kb())
+
+
+@router.message(StateFilter(States.AddCourse.waiting_price))
+async def admin_add_course_price(message: Message, state: FSMContext):
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Отменено.", reply_markup=kb.reply_admin_menu())
+        return
+    if not message.text.isdigit():
+        await message.answer("Цена должна быть целым числом. Попробуйте ещё раз.")
+        return
+    await state.update_data(price=int(message.text))
+    await state.set_state(States.AddCourse.waiting_link)
+    await message.answer("Вставьте ссылку на курс (или ❌ Отмена):", reply_markup=kb.cancel_kb())
+
+
+@router.message(StateFilter(States.AddCourse.waiting_link))
+async def admin_add_course_link(message: Message, state: FSMContext):
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Отменено.", reply_markup=kb.reply_admin_menu())
+        return
+    data = await state.get_data()
+    c_id = data.get("category_id")
+    title = data.get("title")
+    description = data.get("description")
+    price = data.get("price")
+    link = message.text.strip()
+    if None in (c_id, title, description, price):
+        await state.clear()
+        await message.answer("Недостаточно данных — операция отменена.", reply_markup=kb.reply_admin_menu())
+        return
+    new_id = await db.add_course(c_id, title, description, price, link)
+    await jobs.enqueue("refresh_recommendations", course_id=new_id)
+    await state.clear()
+    await message.answer("Курс создан.", reply_markup=kb.reply_admin_menu())
+
+
+@router.message(F.text == "📘 Управление курсами")
+async def admin_manage_courses(message: Message):
+    if not is_admin(message.from_user.id):
+        return
+    courses = await db.get_all_courses()
+    if not courses:
+        await message.answer("Курсов нет.", reply_markup=kb.reply_admin_menu())
+        return
+    await message.answer("Курсы (редактирование/удаление):", reply_markup=kb.edit_delete_courses(courses))
+
+
+@router.callback_query(F.data.startswith("delete_course:"))
+async def admin_delete_course(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    cid = extract_int(callback.data)
+    if cid is None:
+        await callback.answer("Ошибка", show_alert=True)
+        return
+    await db.delete_course(cid)
+    await jobs.enqueue("refresh_recommendations", course_id=cid)
+    await callback.message.answer("Курс удалён.", reply_markup=kb.reply_admin_menu())
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("edit_course:"))
+async def admin_edit_course_start(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    cid = extract_int(callback.data)
+    if cid is None:
+        await callback.answer("Ошибка", show_alert=True)
+        return
+    await state.update_data(edit_course_id=cid)
+    await state.set_state(States.EditCourse.waiting_field_choice)
+    await callback.message.answer("Выберите поле для редактирования:", reply_markup=kb.edit_course_fields(cid))
+    await callback.answer()
+
+
+@router.callback_query(F.data.regexp(r"^edit_course_field:(title|description|price|link|cover|material):\d+$"))
+async def admin_edit_course_field(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    parts = callback.data.split(":")
+    field = parts[1]
+    cid = int(parts[2])
+    await state.update_data(edit_course_id=cid, edit_field=field)
+    await state.set_state(States.EditCourse.waiting_new_value)
+    if field in ("cover", "material"):
+        await callback.message.answer(f"Введи путь к файлу в <code>{html.escape(media.MEDIA_DIR)}</code> для <b>{field}</b>, «-» чтобы убрать (или ❌ Отмена):", reply_markup=kb.cancel_kb())
+    else:
+        await callback.message.answer(f"Введи новое значение для <b>{field}</b> (или ❌ Отмена):", reply_markup=kb.cancel_kb())
+    await callback.answer()
+
+
+@router.message(StateFilter(States.EditCourse.waiting_new_value))
+async def admin_save_edited_course_value(message: Message, state: FSMContext):
+    if message.text == "❌ Отмена":
+        await state.clear()
+        await message.answer("Отменено.", reply_markup=kb.reply_admin_menu())
+        return
+    data = await state.get_data()
+    cid = data.get("edit_course_id")
+    field = data.get("edit_field")
+    if cid is None or not field:
+        await state.clear()
+        await message.answer("Нет данных для редактирования.", reply_markup=kb.reply_admin_menu())
+        return
+    val = message.text.strip()
+    if field == "price":
+        if not val.isdigit():
+            await message.answer("Цена должна быть числом.")
+            return
+        val = int(val)
+    elif field in ("cover", "material"):
+        if val == "-":
+            val = None
+        else:
+            resolved = media.resolve(val)
+            if resolved is None:
+                await message.answer("Файл не найден в каталоге медиа. Попробуйте ещё раз.")
+                return
+            val = resolved
+    await db.update_course_field(cid, field, val)
+    if field in ("title", "description", "category_id"):
+        await jobs.enqueue("refresh_recommendations", course_id=cid)
+    await state.clear()
+    await message.answer("Курс обновлён.", reply_markup=kb.reply_admin_menu())
@@ -0,0 +1,221 @@
+# backup.py
+# Онлайн-бэкапы SQLite через backup API: копируем по BACKUP_PAGES страниц за шаг и
+# между шагами отпускаем базу, так что хендлеры и воркеры почти не ждут.
+# Любая запись в базу перезапускает такой бэкап с первой страницы; после
+# BACKUP_MAX_RESTARTS перезапусков докопируем одним шагом, иначе под постоянной
+# нагрузкой снимок не закончится никогда. База в WAL (db.create_tables), так что и
+# этот шаг держит только снимок для чтения и писателей не блокирует. Снимки хранятся в BACKUP_DIR с ротацией. Восстановление возвращает только данные
+# каталога (RESTORE_TABLES): очередь задач, inbox апдейтов и offset остаются текущими,
+# иначе после отката бот заново выполнил бы уже сделанное.
+import asyncio
+import logging
+import os
+import sqlite3
+import statistics
+import time
+
+import db
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", "21600") or 21600)  # раз в 6 часов
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "10") or 10)
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "64") or 64)
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3") or 3)
+BACKUP_STEP_SLEEP = 0.005
+PROBE_INTERVAL = 0.05
+RESTORE_TABLES = ("categories", "courses", "media")
+
+
+def _prefix() -> str:
+    return os.path.splitext(os.path.basename(db.DB_PATH))[0] + "-"
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _copy(src_path: str, dest_path: str, pages: int, step_sleep: float,
+          max_restarts: int = BACKUP_MAX_RESTARTS) -> tuple[int, int]:
+    """Скопировать базу шагами по pages страниц; вернуть (шагов, перезапусков)."""
+    steps = 0
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal steps, restarts, last_remaining
+        steps += 1
+        # кто-то записал в базу — SQLite начал копирование заново
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts >= max_restarts:
+                raise _TooManyRestarts
+        last_remaining = remaining
+        # sleep= у backup() срабатывает только на BUSY/LOCKED; пауза между шагами —
+        # это окно, в которое писатели из db.py успевают взять блокировку
+        if remaining and step_sleep:
+            time.sleep(step_sleep)
+
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dest_path)
+    try:
+        try:
+            src.backup(dst, pages=pages, progress=progress, sleep=step_sleep)
+        except _TooManyRestarts:
+            logger.warning("Backup restarted %s times under writes, copying in a single step", restarts)
+            steps += 1
+            src.backup(dst, pages=-1)
+    finally:
+        dst.close()
+        src.close()
+    return steps, restarts
+
+
+def _restore_tables(snapshot_path: str, live_path: str) -> dict:
+    """Перелить RESTORE_TABLES из снимка в живую базу одной транзакцией."""
+    conn = sqlite3.connect(live_path, isolation_level=None)
+    try:
+        conn.execute("ATTACH DATABASE ? AS snap", (snapshot_path,))
+        conn.execute("BEGIN IMMEDIATE")
+        counts = {}
+        try:
+            for table in RESTORE_TABLES:
+                live_cols = [r[1] for r in conn.execute(f"PRAGMA main.table_info({table})")]
+                snap_cols = {r[1] for r in conn.execute(f"PRAGMA snap.table_info({table})")}
+                cols = ", ".join(c for c in live_cols if c in snap_cols)
+                conn.execute(f"DELETE FROM main.{table}")
+                if cols:
+                    conn.execute(f"INSERT INTO main.{table} ({cols}) SELECT {cols} FROM snap.{table}")
+                counts[table] = conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("DETACH DATABASE snap")
+        return counts
+    finally:
+        conn.close()
+
+
+def list_snapshots() -> list[str]:
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    prefix = _prefix()
+    return sorted(f for f in os.listdir(BACKUP_DIR) if f.startswith(prefix) and f.endswith(".db"))
+
+
+def rotate(keep: int = BACKUP_KEEP) -> list[str]:
+    removed = []
+    for name in list_snapshots()[:-keep] if keep > 0 else []:
+        os.remove(os.path.join(BACKUP_DIR, name))
+        removed.append(name)
+    return removed
+
+
+async def _probe(stop: asyncio.Event, lags: list, reads: list) -> None:
+    """Замер "как бэкап мешает хендлерам": лаг event loop и время чтения из db.py."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append((time.perf_counter() - started - PROBE_INTERVAL) * 1000)
+        started = time.perf_counter()
+        await db.get_categories()
+        reads.append((time.perf_counter() - started) * 1000)
+
+
+async def backup_once(pages: int = BACKUP_PAGES) -> dict:
+    """Снять снимок базы, прогнать ротацию и вернуть метрики."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    now = time.time()
+    name = f"{_prefix()}{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}.db"
+    dest = os.path.join(BACKUP_DIR, name)
+    tmp = dest + ".part"
+
+    baseline: list = []
+    for _ in range(3):
+        started = time.perf_counter()
+        await db.get_categories()
+        baseline.append((time.perf_counter() - started) * 1000)
+
+    lags: list = []
+    reads: list = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_probe(stop, lags, reads))
+    started = time.perf_counter()
+    try:
+        steps, restarts = await asyncio.to_thread(_copy, db.DB_PATH, tmp, pages, BACKUP_STEP_SLEEP)
+        os.replace(tmp, dest)
+    finally:
+        duration = time.perf_counter() - started
+        stop.set()
+        await probe
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    removed = rotate()
+    stats = {
+        "name": name,
+        "size_kb": os.path.getsize(dest) // 1024,
+        "steps": steps,
+        "restarts": restarts,
+        "duration_s": round(duration, 3),
+        "loop_lag_max_ms": round(max(lags, default=0), 1),
+        "read_baseline_ms": round(statistics.median(baseline), 2),
+        "read_during_ms": round(statistics.median(reads), 2) if reads else None,
+        "rotated": removed,
+    }
+    logger.info("Backup done: %s", stats)
+    return stats
+
+
+async def restore(name: str) -> tuple[str, dict]:
+    """Восстановить каталог из снимка; текущее состояние предварительно сохраняется.
+
+    Возвращает (имя страховочного снимка, {таблица: строк после восстановления}).
+    """
+    if name not in list_snapshots():
+        raise ValueError(f"Нет такого снимка: {name}")
+    path = os.path.join(BACKUP_DIR, name)
+    # читаем снимок заранее: страховочный бэкап может вытеснить его ротацией
+    staging = path + ".restore"
+    await asyncio.to_thread(_copy, path, staging, -1, 0)
+    try:
+        safety = await backup_once()
+        counts = await asyncio.to_thread(_restore_tables, staging, db.DB_PATH)
+    finally:
+        os.remove(staging)
+    logger.warning("Catalog restored from %s %s (previous state saved as %s)", name, counts, safety["name"])
+    return safety["name"], counts
+
+
+async def backup_loop(interval: int = BACKUP_INTERVAL) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await backup_once()
+        except Exception:
+            logger.exception("Scheduled backup failed")
+
+
+def format_stats(stats: dict) -> str:
+    during = stats["read_during_ms"]
+    return (
+        f"💾 {stats['name']} ({stats['size_kb']} KB)\n"
+        f"Время: {stats['duration_s']} с, шагов: {stats['steps']}, перезапусков: {stats['restarts']}\n"
+        f"Лаг loop (макс): {stats['loop_lag_max_ms']} мс\n"
+        f"Чтение из БД: {stats['read_baseline_ms']} мс до / {during if during is not None else '—'} мс во время"
+    )
+
+
+# python backup.py — снять снимок; python backup.py restore <имя> — восстановить каталог
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    if len(sys.argv) == 3 and sys.argv[1] == "restore":
+        safety, counts = asyncio.run(restore(sys.argv[2]))
+        print(f"Restored {counts}, previous state saved as {safety}")
+    elif len(sys.argv) == 1:
+        print(format_stats(asyncio.run(backup_once())))
+    else:
+        print("usage: python backup.py [restore <snapshot>]")
@@ -0,0 +1,142 @@
+# bench_startup.py
+# Замер холодного старта: импорт по фазам, warm_up() и time-to-first-update.
+# Каждый прогон — свежий процесс (python -X importtime) с временной БД и фейковой
+# сессией Bot API, сеть не нужна. Запуск: python bench_startup.py [прогонов]
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# модули, чьё кумулятивное время импорта показываем отдельно
+TRACKED_IMPORTS = (
+    "aiogram", "aiosqlite", "dotenv", "config", "tracing", "db", "jobs", "keyboards", "lifecycle",
+    "media", "recommendations", "tasks", "helpers", "payments", "admin", "profiler", "backup",
+)
+
+CONFIGS = {
+    # только пользовательская часть: payments/admin не импортируются
+    "minimal": {"ADMIN_ID": "", "PAYMENT_PROVIDER_TOKEN": ""},
+    "full": {"ADMIN_ID": "1", "PAYMENT_PROVIDER_TOKEN": "bench"},
+}
+
+
+def child() -> None:
+    spawned_at = float(os.environ["BENCH_SPAWNED_AT"])
+    result = {"interpreter_ms": (time.time() - spawned_at) * 1000}
+    started = time.perf_counter()
+    import asyncio
+    from datetime import datetime
+
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import GetMe, SendMessage
+    from aiogram.types import Chat, Message, Update, User
+    result["import_aiogram_ms"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    import Bot as app
+    result["import_app_ms"] = (time.perf_counter() - started) * 1000
+
+    class FakeSession(BaseSession):
+        async def make_request(self, bot, method, timeout=None):
+            if isinstance(method, GetMe):
+                return User(id=42, is_bot=True, first_name="bench", username="bench_bot")
+            if isinstance(method, SendMessage):
+                return Message(message_id=1, date=datetime.now(), chat=Chat(id=method.chat_id, type="private"),
+                               text=method.text)
+            return True
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def close(self):
+            pass
+
+    session = FakeSession()
+    session.middleware = app.bot.session.middleware  # трейсинг запросов тоже считается
+    app.bot.session = session
+
+    def start_update(update_id: int) -> Update:
+        user = User(id=100, is_bot=False, first_name="user")
+        msg = Message(message_id=update_id, date=datetime.now(), chat=Chat(id=100, type="private"),
+                      from_user=user, text="/start")
+        return Update(update_id=update_id, message=msg)
+
+    async def run():
+        started = time.perf_counter()
+        result["warm_up"] = await app.warm_up()
+        result["warm_up_ms"] = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        await app.dp.feed_update(app.bot, start_update(1))
+        result["first_update_ms"] = (time.perf_counter() - started) * 1000
+        result["time_to_first_update_ms"] = (time.time() - spawned_at) * 1000
+        started = time.perf_counter()
+        await app.dp.feed_update(app.bot, start_update(2))
+        result["second_update_ms"] = (time.perf_counter() - started) * 1000
+
+    asyncio.run(run())
+    app.log_listener.stop()
+    print("BENCH " + json.dumps(result))
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Кумулятивное время импорта (мс) для TRACKED_IMPORTS из вывода -X importtime."""
+    found = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            found[name.strip()] = int(cumulative) / 1000
+        except ValueError:
+            continue
+    return {name: found[name] for name in TRACKED_IMPORTS if name in found}
+
+
+def run_once(overrides: dict) -> tuple[dict, dict]:
+    env = dict(os.environ, BOT_TOKEN="42:BENCH", LOG_LEVEL="WARNING", **overrides)
+    env["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+    env["BENCH_SPAWNED_AT"] = repr(time.time())
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.abspath(__file__), "--child"],
+        env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    line = next((l for l in proc.stdout.splitlines() if l.startswith("BENCH ")), None)
+    if proc.returncode or line is None:
+        raise RuntimeError(f"benchmark child failed:\n{proc.stderr[-2000:]}")
+    return json.loads(line[len("BENCH "):]), parse_importtime(proc.stderr)
+
+
+def report(name: str, runs: list) -> None:
+    def med(values):
+        return statistics.median(values)
+
+    results = [r for r, _ in runs]
+    print(f"== {name} ({len(runs)} runs, median) ==")
+    for key in ("interpreter_ms", "import_aiogram_ms", "import_app_ms", "warm_up_ms",
+                "first_update_ms", "second_update_ms", "time_to_first_update_ms"):
+        print(f"  {key:<26}{med([r[key] for r in results]):9.1f}")
+    print("  warm_up phases:")
+    for phase in results[0]["warm_up"]:
+        print(f"    {phase:<24}{med([r['warm_up'][phase] for r in results]):9.1f}")
+    print("  imports (cumulative ms):")
+    imports = [i for _, i in runs]
+    for module in TRACKED_IMPORTS:
+        values = [i[module] for i in imports if module in i]
+        if values:
+            print(f"    {module:<24}{med(values):9.1f}")
+
+
+def main() -> None:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for name, overrides in CONFIGS.items():
+        report(name, [run_once(overrides) for _ in range(runs)])
+
+
+if __name__ == "__main__":
+    if "--child" in sys.argv:
+        child()
+    else:
+        main()
@@ -0,0 +1,11 @@
+# config.py
+# Единственное место, где читается .env: остальные модули берут настройки из os.getenv
+# при импорте, поэтому config импортируется раньше них.
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+ADMIN_ID = int(os.getenv("ADMIN_ID", "0") or 0)
+PAYMENT_PROVIDER_TOKEN = os.getenv("PAYMENT_PROVIDER_TOKEN", "")  # leave empty if not configured
@@ -2,18 +2,24 @@
 # Работа с SQLite через aiosqlite. Все функции возвращают словари (id/title/..)
 import aiosqlite
 import os
-from dotenv import load_dotenv
+import time
+
+import config  # noqa: F401 — .env должен быть прочитан до os.getenv ниже
+from tracing import traced
 
-load_dotenv()
 DB_PATH = os.getenv("DB_PATH", "database.db")
 
 
+@traced
 async def create_tables():
     """Создать таблицы, если их нет."""
     async with aiosqlite.connect(DB_PATH) as db:
         await db.execute("""
         PRAGMA foreign_keys = ON;
         """)
+        # WAL (режим хранится в файле базы): читатели, в том числе онлайн-бэкап из
+        # backup.py, не блокируют писателей и наоборот
+        await db.execute("PRAGMA journal_mode = WAL")
         await db.execute("""
         CREATE TABLE IF NOT EXISTS categories (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -28,19 +34,100 @@ async def create_tables():
             description TEXT,
             price INTEGER DEFAULT 0,
             link TEXT,
+            cover TEXT,
+            material TEXT,
             FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE SET NULL
         );
         """)
+        # старые базы: докидываем колонки под медиа курса
+        cur = await db.execute("PRAGMA table_info(courses)")
+        columns = {r[1] for r in await cur.fetchall()}
+        for column in ("cover", "material"):
+            if column not in columns:
+                await db.execute(f"ALTER TABLE courses ADD COLUMN {column} TEXT")
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS media (
+            content_hash TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            path TEXT,
+            PRIMARY KEY (content_hash, kind)
+        );
+        """)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_at REAL NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            owner TEXT,
+            trace_id TEXT
+        );
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, run_at)")
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS dead_jobs (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            failed_at REAL NOT NULL
+        );
+        """)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        """)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS update_inbox (
+            update_id INTEGER PRIMARY KEY,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            owner TEXT
+        );
+        """)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS purchases (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            course_id INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        );
+        """)
+        # покупка пишется один раз на (пользователь, курс): повтор задачи доставки её не дублирует
+        await db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_purchases_user_course ON purchases (user_id, course_id)"
+        )
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_purchases_course ON purchases (course_id)")
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS course_similarity (
+            course_id INTEGER NOT NULL,
+            related_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (course_id, related_id)
+        );
+        """)
         await db.commit()
 
 
 # ---------------- Categories ----------------
+@traced
 async def add_category(title: str) -> None:
     async with aiosqlite.connect(DB_PATH) as db:
         await db.execute("INSERT OR IGNORE INTO categories (title) VALUES (?)", (title,))
         await db.commit()
 
 
+@traced
 async def get_categories() -> list:
     async with aiosqlite.connect(DB_PATH) as db:
         cur = await db.execute("SELECT id, title FROM categories ORDER BY id")
@@ -48,65 +135,82 @@ async def get_categories() -> list:
         return [{"id": r[0], "title": r[1]} for r in rows]
 
 
+@traced
 async def update_category(category_id: int, new_title: str) -> None:
     async with aiosqlite.connect(DB_PATH) as db:
         await db.execute("UPDATE categories SET title = ? WHERE id = ?", (new_title, category_id))
         await db.commit()
 
 
-async def delete_category(category_id: int) -> None:
+@traced
+async def delete_category(category_id: int, detach_courses: bool = True) -> None:
     async with aiosqlite.connect(DB_PATH) as db:
         # удаляем категорию; курсы остаются, category_id станет NULL
         await db.execute("DELETE FROM categories WHERE id = ?", (category_id,))
+        if detach_courses:
+            await db.execute("UPDATE courses SET category_id = NULL WHERE category_id = ?", (category_id,))
+        await db.commit()
+
+
+@traced
+async def detach_courses_from_category(category_id: int) -> None:
+    async with aiosqlite.connect(DB_PATH) as db:
         await db.execute("UPDATE courses SET category_id = NULL WHERE category_id = ?", (category_id,))
         await db.commit()
 
 
 # ---------------- Courses ----------------
-async def add_course(category_id: int, title: str, description: str, price: int, link: str) -> None:
+def _course_row(r) -> dict:
+    return {
+        "id": r[0], "category_id": r[1], "title": r[2], "description": r[3], "price": r[4], "link": r[5],
+        "cover": r[6], "material": r[7],
+    }
+
+
+@traced
+async def add_course(category_id: int, title: str, description: str, price: int, link: str) -> int:
     async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
+        cur = await db.execute(
             "INSERT INTO courses (category_id, title, description, price, link) VALUES (?, ?, ?, ?, ?)",
             (category_id, title, description, price, link)
         )
         await db.commit()
+        return cur.lastrowid
 
 
+@traced
 async def get_courses_by_category(category_id: int) -> list:
     async with aiosqlite.connect(DB_PATH) as db:
         cur = await db.execute(
-            "SELECT id, title, description, price, link, category_id FROM courses WHERE category_id = ? ORDER BY id",
+            "SELECT id, category_id, title, description, price, link, cover, material FROM courses WHERE category_id = ? ORDER BY id",
             (category_id,)
         )
         rows = await cur.fetchall()
-        return [
-            {"id": r[0], "title": r[1], "description": r[2], "price": r[3], "link": r[4], "category_id": r[5]}
-            for r in rows
-        ]
+        return [_course_row(r) for r in rows]
 
 
+@traced
 async def get_course(course_id: int) -> dict | None:
     async with aiosqlite.connect(DB_PATH) as db:
         cur = await db.execute(
-            "SELECT id, category_id, title, description, price, link FROM courses WHERE id = ?",
+            "SELECT id, category_id, title, description, price, link, cover, material FROM courses WHERE id = ?",
             (course_id,)
         )
         r = await cur.fetchone()
         if not r:
             return None
-        return {"id": r[0], "category_id": r[1], "title": r[2], "description": r[3], "price": r[4], "link": r[5]}
+        return _course_row(r)
 
 
+@traced
 async def get_all_courses() -> list:
     async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT id, category_id, title, description, price, link FROM courses ORDER BY id")
+        cur = await db.execute("SELECT id, category_id, title, description, price, link, cover, material FROM courses ORDER BY id")
         rows = await cur.fetchall()
-        return [
-            {"id": r[0], "category_id": r[1], "title": r[2], "description": r[3], "price": r[4], "link": r[5]}
-            for r in rows
-        ]
+        return [_course_row(r) for r in rows]
 
 
+@traced
 async def update_course(course_id: int, title: str, description: str, price: int, link: str, category_id: int | None = None) -> None:
     async with aiosqlite.connect(DB_PATH) as db:
         if category_id is None:
@@ -122,20 +226,340 @@ async def update_course(course_id: int, title: str, description: str, price: int
         await db.commit()
 
 
+@traced
 async def update_course_field(course_id: int, field: str, value) -> None:
-    if field not in ("title", "description", "price", "link", "category_id"):
+    if field not in ("title", "description", "price", "link", "category_id", "cover", "material"):
         raise ValueError("Unsupported field")
     async with aiosqlite.connect(DB_PATH) as db:
         await db.execute(f"UPDATE courses SET {field} = ? WHERE id = ?", (value, course_id))
         await db.commit()
 
 
+@traced
 async def delete_course(course_id: int) -> None:
     async with aiosqlite.connect(DB_PATH) as db:
         await db.execute("DELETE FROM courses WHERE id = ?", (course_id,))
         await db.commit()
 
 
+# ---------------- Purchases ----------------
+@traced
+async def add_purchase(user_id: int, course_id: int) -> bool:
+    """Записать покупку; False — она уже была (повтор доставки или повторная оплата)."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute(
+            "INSERT OR IGNORE INTO purchases (user_id, course_id, created_at) VALUES (?, ?, ?)",
+            (user_id, course_id, time.time())
+        )
+        await db.commit()
+        return cur.rowcount > 0
+
+
+@traced
+async def get_purchase_stats() -> tuple:
+    """(buyers, co): buyers[course_id] — число покупателей, co[(a, b)] — купивших оба курса (a < b)."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute("SELECT course_id, COUNT(DISTINCT user_id) FROM purchases GROUP BY course_id")
+        buyers = {r[0]: r[1] for r in await cur.fetchall()}
+        cur = await db.execute("""
+            SELECT a.course_id, b.course_id, COUNT(DISTINCT a.user_id)
+            FROM purchases a JOIN purchases b ON a.user_id = b.user_id AND a.course_id < b.course_id
+            GROUP BY a.course_id, b.course_id
+        """)
+        co = {(r[0], r[1]): r[2] for r in await cur.fetchall()}
+        return buyers, co
+
+
+@traced
+async def get_course_purchase_stats(course_id: int) -> tuple:
+    """То же, что get_purchase_stats, но только для пар с course_id.
+
+    buyers — по course_id и курсам, которые покупали вместе с ним; co — пары с course_id.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute("""
+            SELECT b.course_id, COUNT(*)
+            FROM purchases a JOIN purchases b ON a.user_id = b.user_id AND b.course_id <> a.course_id
+            WHERE a.course_id = ?
+            GROUP BY b.course_id
+        """, (course_id,))
+        co = {(min(course_id, r[0]), max(course_id, r[0])): r[1] for r in await cur.fetchall()}
+        ids = [course_id] + [b if a == course_id else a for a, b in co]
+        cur = await db.execute(
+            f"SELECT course_id, COUNT(*) FROM purchases WHERE course_id IN ({', '.join('?' * len(ids))}) GROUP BY course_id",
+            ids
+        )
+        buyers = {r[0]: r[1] for r in await cur.fetchall()}
+        return buyers, co
+
+
+# ---------------- Course similarity (recommendations index) ----------------
+@traced
+async def get_similarities() -> list:
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute("SELECT course_id, related_id, score FROM course_similarity")
+        return [(r[0], r[1], r[2]) for r in await cur.fetchall()]
+
+
+@traced
+async def replace_similarities(rows: list, course_id: int | None = None) -> None:
+    """Записать пары (course_id, related_id, score).
+
+    course_id=None — полная пересборка индекса, иначе заменяются только пары с этим курсом.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        if course_id is None:
+            await db.execute("DELETE FROM course_similarity")
+        else:
+            await db.execute(
+                "DELETE FROM course_similarity WHERE course_id = ? OR related_id = ?", (course_id, course_id)
+            )
+        await db.executemany(
+            "INSERT OR REPLACE INTO course_similarity (course_id, related_id, score) VALUES (?, ?, ?)", rows
+        )
+        await db.commit()
+
+
+# ---------------- Media (Telegram file_id cache) ----------------
+@traced
+async def get_media_file_id(content_hash: str, kind: str) -> str | None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute(
+            "SELECT file_id FROM media WHERE content_hash = ? AND kind = ?", (content_hash, kind)
+        )
+        r = await cur.fetchone()
+        return r[0] if r else None
+
+
+@traced
+async def save_media_file_id(content_hash: str, kind: str, file_id: str, path: str | None = None) -> None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            "INSERT OR REPLACE INTO media (content_hash, kind, file_id, path) VALUES (?, ?, ?, ?)",
+            (content_hash, kind, file_id, path)
+        )
+        await db.commit()
+
+
+@traced
+async def delete_media(content_hash: str, kind: str) -> None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("DELETE FROM media WHERE content_hash = ? AND kind = ?", (content_hash, kind))
+        await db.commit()
+
+
+# ---------------- Jobs (background queue) ----------------
+@traced
+async def enqueue_job(kind: str, payload: str, run_at: float, max_attempts: int = 5,
+                      trace_id: str | None = None) -> int:
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute(
+            "INSERT INTO jobs (kind, payload, max_attempts, run_at, created_at, trace_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, payload, max_attempts, run_at, time.time(), trace_id)
+        )
+        await db.commit()
+        return cur.lastrowid
+
+
+@traced
+async def claim_job(now: float, owner: str) -> dict | None:
+    """Атомарно забрать одну созревшую задачу (pending -> running) за процессом owner."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute(
+            """
+            UPDATE jobs SET status = 'running', attempts = attempts + 1, owner = ?
+            WHERE id = (
+                SELECT id FROM jobs WHERE status = 'pending' AND run_at <= ? ORDER BY run_at, id LIMIT 1
+            )
+            RETURNING id, kind, payload, attempts, max_attempts, trace_id
+            """,
+            (owner, now)
+        )
+        r = await cur.fetchone()
+        await db.commit()
+        if not r:
+            return None
+        return {"id": r[0], "kind": r[1], "payload": r[2], "attempts": r[3], "max_attempts": r[4], "trace_id": r[5]}
+
+
+@traced
+async def next_job_run_at() -> float | None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute("SELECT MIN(run_at) FROM jobs WHERE status = 'pending'")
+        r = await cur.fetchone()
+        return r[0] if r else None
+
+
+@traced
+async def finish_job(job_id: int) -> None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        await db.commit()
+
+
+@traced
+async def retry_job(job_id: int, run_at: float, error: str) -> None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            "UPDATE jobs SET status = 'pending', owner = NULL, run_at = ?, last_error = ? WHERE id = ?",
+            (run_at, error, job_id)
+        )
+        await db.commit()
+
+
+@traced
+async def bury_job(job_id: int, error: str) -> None:
+    """Перенести задачу в dead_jobs (исчерпаны попытки или неизвестный тип)."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            """
+            INSERT OR REPLACE INTO dead_jobs (id, kind, payload, attempts, last_error, created_at, failed_at)
+            SELECT id, kind, payload, attempts, ?, created_at, ? FROM jobs WHERE id = ?
+            """,
+            (error, time.time(), job_id)
+        )
+        await db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        await db.commit()
+
+
+@traced
+async def requeue_running_jobs(owner: str, now: float) -> int:
+    """Вернуть в очередь running-задачи, которые больше никто не выполняет.
+
+    Как и claim_pending_updates: трогаем только задачи процессов без живой аренды
+    (poller:<id> в bot_state) — старый процесс может ещё дорабатывать свои.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            "DELETE FROM bot_state WHERE key LIKE 'poller:%' AND CAST(value AS REAL) <= ?", (now,)
+        )
+        cur = await db.execute(
+            """
+            UPDATE jobs SET status = 'pending', owner = NULL
+            WHERE status = 'running' AND (
+                owner IS NULL OR (
+                    owner <> ?
+                    AND NOT EXISTS (SELECT 1 FROM bot_state WHERE key = 'poller:' || jobs.owner)
+                )
+            )
+            """,
+            (owner,)
+        )
+        await db.commit()
+        return cur.rowcount
+
+
+# ---------------- Bot state / update inbox (polling handoff) ----------------
+@traced
+async def get_state(key: str) -> str | None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute("SELECT value FROM bot_state WHERE key = ?", (key,))
+        r = await cur.fetchone()
+        return r[0] if r else None
+
+
+@traced
+async def set_state(key: str, value: str) -> None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)", (key, value))
+        await db.commit()
+
+
+@traced
+async def journal_updates(updates: list, next_offset: int, owner: str) -> list:
+    """Записать полученные апдейты в inbox и новый offset одной транзакцией.
+
+    updates: list of (update_id, body). Новые апдейты закрепляются за owner.
+    Возвращает id, которых ещё не было в inbox (уже виденные — дубли после
+    рестарта или от второго поллера, их не обрабатываем повторно).
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        # сохранённый offset — граница: всё ниже уже журналировано (done-метки могли
+        # быть удалены), поэтому такие апдейты из запоздавшего ответа не считаем новыми
+        await db.execute("BEGIN IMMEDIATE")
+        cur = await db.execute("SELECT value FROM bot_state WHERE key = 'polling_offset'")
+        r = await cur.fetchone()
+        floor = int(r[0]) if r else 0
+        fresh = []
+        for update_id, body in updates:
+            if update_id < floor:
+                continue
+            cur = await db.execute(
+                "INSERT OR IGNORE INTO update_inbox (update_id, body, owner) VALUES (?, ?, ?)",
+                (update_id, body, owner)
+            )
+            if cur.rowcount:
+                fresh.append(update_id)
+        next_offset = max(floor, next_offset)
+        await db.execute(
+            "INSERT OR REPLACE INTO bot_state (key, value) VALUES ('polling_offset', ?)", (str(next_offset),)
+        )
+        # ниже offset Telegram их уже не пришлёт — метки "done" больше не нужны
+        await db.execute("DELETE FROM update_inbox WHERE status = 'done' AND update_id < ?", (next_offset,))
+        await db.commit()
+        return fresh
+
+
+@traced
+async def renew_poller_lease(owner: str, expires_at: float) -> None:
+    """Пульс процесса: пока аренда жива, его pending-апдейты и running-задачи никто не трогает."""
+    await set_state(f"poller:{owner}", repr(expires_at))
+
+
+@traced
+async def drop_poller_lease(owner: str) -> None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("DELETE FROM bot_state WHERE key = ?", (f"poller:{owner}",))
+        await db.commit()
+
+
+@traced
+async def claim_pending_updates(owner: str, now: float) -> list:
+    """Забрать себе pending-апдейты, у которых нет живого владельца.
+
+    Ничьи — отпущенные после дренажа (release_updates);
+    просроченная аренда — процесс умер, не успев их отпустить.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            "DELETE FROM bot_state WHERE key LIKE 'poller:%' AND CAST(value AS REAL) <= ?", (now,)
+        )
+        cur = await db.execute(
+            """
+            UPDATE update_inbox SET owner = ?
+            WHERE status = 'pending' AND (
+                owner IS NULL OR (
+                    owner <> ?
+                    AND NOT EXISTS (SELECT 1 FROM bot_state WHERE key = 'poller:' || update_inbox.owner)
+                )
+            )
+            RETURNING update_id, body
+            """,
+            (owner, owner)
+        )
+        rows = await cur.fetchall()
+        await db.commit()
+        return sorted((r[0], r[1]) for r in rows)
+
+
+@traced
+async def release_updates(owner: str) -> int:
+    """Отпустить недоделанные апдейты после дренажа; вернуть их число."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        cur = await db.execute(
+            "UPDATE update_inbox SET owner = NULL WHERE owner = ? AND status = 'pending'", (owner,)
+        )
+        await db.commit()
+        return cur.rowcount
+
+
+@traced
+async def mark_update_done(update_id: int) -> None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute("UPDATE update_inbox SET status = 'done' WHERE update_id = ?", (update_id,))
+        await db.commit()
+
+
 # If run directly, create tables
 if __name__ == "__main__":
     import asyncio
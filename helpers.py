@@ -0,0 +1,16 @@
+# helpers.py
+# Мелочи, общие для Bot.py и подключаемых роутеров (payments, admin).
+import re
+
+import config
+
+
+def extract_int(s: str | None) -> int | None:
+    if not s:
+        return None
+    m = re.search(r"(\d+)", s)
+    return int(m.group(1)) if m else None
+
+
+def is_admin(user_id: int) -> bool:
+    return user_id == config.ADMIN_ID
@@ -0,0 +1,154 @@
+# jobs.py
+# Фоновая очередь задач поверх SQLite (таблицы jobs / dead_jobs в db.py).
+# Хендлеры только ставят задачу через enqueue() и сразу отвечают Telegram,
+# тяжёлую/медленную работу делают воркеры, запущенные в main().
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+
+import db
+import tracing
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2") or 2)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5") or 5)
+BACKOFF_BASE = 2.0    # секунд до первого повтора
+BACKOFF_MAX = 600.0   # потолок задержки между повторами
+IDLE_POLL = 5.0       # как часто воркер сам заглядывает в очередь, если его не будят
+REQUEUE_INTERVAL = 30.0  # как часто подбирать задачи умерших процессов (их аренда истекла)
+
+JobHandler = Callable[..., Awaitable[None]]
+
+_handlers: dict[str, JobHandler] = {}
+_wakeup = asyncio.Event()
+
+
+def job(kind: str):
+    """Декоратор: зарегистрировать обработчик задач типа kind.
+
+    Обработчик вызывается как handler(bot, **payload); исключение = неудачная попытка.
+    """
+    def decorator(func: JobHandler) -> JobHandler:
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+async def enqueue(kind: str, delay: float = 0, max_attempts: int = JOB_MAX_ATTEMPTS, **payload) -> int:
+    # задача продолжает трейс того, кто её поставил: её запросы к Bot API и БД
+    # связываются с исходным апдейтом (например, оплатой) по одному trace_id
+    job_id = await db.enqueue_job(kind, json.dumps(payload, ensure_ascii=False), time.time() + delay, max_attempts,
+                                  trace_id=tracing.current_trace_id())
+    _wakeup.set()
+    return job_id
+
+
+def backoff(attempts: int) -> float:
+    """Экспоненциальная задержка с небольшим джиттером: 2, 4, 8 ... секунд."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (attempts - 1)))
+    return delay * random.uniform(0.9, 1.1)
+
+
+async def _settle(item: dict, action: Awaitable[None]) -> None:
+    """Записать итог задачи; ошибка БД не должна убивать воркер.
+
+    Если запись не удалась, задача остаётся running за этим процессом и вернётся
+    в очередь, когда его аренда будет снята (requeue_running_jobs).
+    """
+    try:
+        await action
+    except Exception:
+        logger.exception("Job %s (%s): failed to record result", item["id"], item["kind"])
+
+
+async def run_job(bot: Bot, item: dict) -> None:
+    handler = _handlers.get(item["kind"])
+    if handler is None:
+        logger.error("No handler for job %s (%s), moving to dead letters", item["id"], item["kind"])
+        await _settle(item, db.bury_job(item["id"], "unknown job kind"))
+        return
+    try:
+        with tracing.trace(f"job:{item['kind']}", trace_id=item.get("trace_id"),
+                           job_id=item["id"], attempt=item["attempts"]):
+            await handler(bot, **json.loads(item["payload"]))
+    except asyncio.CancelledError:
+        # воркер останавливают посреди задачи — вернём её в очередь
+        await _settle(item, db.retry_job(item["id"], time.time(), "cancelled"))
+        raise
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if item["attempts"] >= item["max_attempts"]:
+            logger.exception("Job %s (%s) failed permanently after %s attempts", item["id"], item["kind"], item["attempts"])
+            await _settle(item, db.bury_job(item["id"], error))
+        else:
+            delay = backoff(item["attempts"])
+            logger.warning("Job %s (%s) failed (attempt %s), retry in %.1fs: %s",
+                           item["id"], item["kind"], item["attempts"], delay, error)
+            await _settle(item, db.retry_job(item["id"], time.time() + delay, error))
+        return
+    await _settle(item, db.finish_job(item["id"]))
+
+
+async def worker(bot: Bot, name: str, owner: str) -> None:
+    logger.info("Job worker %s started", name)
+    while True:
+        # сбрасываем до claim: enqueue() между claim и ожиданием не потеряется
+        _wakeup.clear()
+        try:
+            item = await db.claim_job(time.time(), owner)
+        except Exception:
+            logger.exception("Job worker %s: claim failed", name)
+            item = None
+        if item is not None:
+            try:
+                await run_job(bot, item)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job worker %s: job %s (%s) crashed", name, item["id"], item["kind"])
+                await asyncio.sleep(1)
+            continue
+        timeout = IDLE_POLL
+        try:
+            next_at = await db.next_job_run_at()
+        except Exception:
+            next_at = None
+        if next_at is not None:
+            timeout = max(0.05, min(IDLE_POLL, next_at - time.time()))
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _requeue_orphans(owner: str) -> None:
+    """Вернуть в очередь задачи процессов, чья аренда снята или истекла."""
+    while True:
+        try:
+            requeued = await db.requeue_running_jobs(owner, time.time())
+            if requeued:
+                logger.info("Requeued %s jobs left running by another process", requeued)
+                _wakeup.set()
+        except Exception:
+            logger.exception("Requeue of orphaned jobs failed")
+        await asyncio.sleep(REQUEUE_INTERVAL)
+
+
+async def start_workers(bot: Bot, owner: str, count: int = JOB_WORKERS) -> list[asyncio.Task]:
+    """Запустить воркеры от имени owner — id процесса с живой арендой (Poller.acquire_lease)."""
+    tasks = [asyncio.create_task(_requeue_orphans(owner), name="job-requeue")]
+    tasks += [asyncio.create_task(worker(bot, f"w{i}", owner), name=f"job-worker-{i}") for i in range(count)]
+    return tasks
+
+
+async def stop_workers(tasks: list[asyncio.Task]) -> None:
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -11,7 +11,7 @@ def reply_main_menu(is_admin: bool = False) -> ReplyKeyboardMarkup:
         [KeyboardButton(text="ℹ️ О боте")]
     ]
     if is_admin:
-        kb.append([KeyboardButton(text="⚙️ Админ-панель")])
+        kb.append([KeyboardButton(text="⚙️ Админ-панель"), KeyboardButton(text="🩺 Профилировщик")])
     return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
 
 
@@ -44,12 +44,16 @@ def courses_list(courses: list, category_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-# Inline: course detail (buy + back to category)
-def course_detail(course: dict) -> InlineKeyboardMarkup:
+# Inline: course detail (buy + related courses + back to category)
+def course_detail(course: dict, related: list | None = None) -> InlineKeyboardMarkup:
     buttons = [
-        [InlineKeyboardButton(text=f"💳 Купить за {int(course.get('price',0))} ₽", callback_data=f"buy:{course['id']}")],
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data=f"back_to_category:{int(course.get('category_id') or 0)}")]
+        [InlineKeyboardButton(text=f"💳 Купить за {int(course.get('price',0))} ₽", callback_data=f"buy:{course['id']}")]
     ]
+    for r in related or []:
+        buttons.append([InlineKeyboardButton(text=f"🔗 {r['title']}", callback_data=f"course:{r['id']}")])
+    buttons.append(
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data=f"back_to_category:{int(course.get('category_id') or 0)}")]
+    )
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
@@ -85,6 +89,8 @@ def edit_course_fields(course_id: int) -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="Описание", callback_data=f"edit_course_field:description:{course_id}")],
         [InlineKeyboardButton(text="Цена", callback_data=f"edit_course_field:price:{course_id}")],
         [InlineKeyboardButton(text="Ссылка", callback_data=f"edit_course_field:link:{course_id}")],
+        [InlineKeyboardButton(text="Обложка", callback_data=f"edit_course_field:cover:{course_id}")],
+        [InlineKeyboardButton(text="Материалы (файл)", callback_data=f"edit_course_field:material:{course_id}")],
         [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_admin")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
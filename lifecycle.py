@@ -0,0 +1,236 @@
+# lifecycle.py
+# Long polling с корректным завершением и передачей offset новому процессу.
+#
+# Каждый полученный апдейт сначала пишется в update_inbox (db.py) вместе с новым offset,
+# и только потом следующий getUpdates подтверждает его Telegram. Поэтому:
+#   * по SIGTERM перестаём забирать апдейты, ждём (с таймаутом) текущие хендлеры,
+#     выполняем shutdown-хуки и закрываем сессию бота;
+#   * недообработанные апдейты остаются в inbox как pending — следующий процесс
+#     начинает с сохранённого offset и доигрывает их, ничего не теряя и не дублируя.
+#
+# Новый процесс может стартовать, пока старый ещё дренажит (rolling deploy), поэтому
+# каждый pending-апдейт закреплён за поллером (owner), а поллер держит аренду в bot_state.
+# Доигрываются только ничьи апдейты: старый отпускает их после дренажа, а если он
+# умер без этого — аренда истекает через LEASE_TTL. Та же аренда защищает running-задачи
+# воркеров jobs.py, поэтому снимается только после shutdown-хуков.
+import asyncio
+import logging
+import os
+import signal
+import time
+import uuid
+from contextlib import suppress
+from typing import Awaitable, Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import (
+    TelegramConflictError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+)
+from aiogram.types import Update
+
+import db
+
+logger = logging.getLogger(__name__)
+
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "10") or 10)
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "25") or 25)
+RETRY_DELAY_MAX = 30.0
+LEASE_TTL = float(os.getenv("POLLER_LEASE_TTL", "60") or 60)
+ADOPT_INTERVAL = 1.0  # как часто проверять inbox на отпущенные другими апдейты
+
+ShutdownHook = Callable[[], Awaitable[None]]
+
+
+class Poller:
+    def __init__(self, bot: Bot, dp: Dispatcher, polling_timeout: int = POLLING_TIMEOUT,
+                 drain_timeout: float = DRAIN_TIMEOUT, lease_ttl: float = LEASE_TTL):
+        self.bot = bot
+        self.dp = dp
+        self.polling_timeout = polling_timeout
+        self.drain_timeout = drain_timeout
+        self.lease_ttl = lease_ttl
+        self.instance_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._stop = asyncio.Event()
+        self._in_flight: set[asyncio.Task] = set()
+        self._shutdown_hooks: list[ShutdownHook] = []
+        self._lease: asyncio.Task | None = None
+
+    def on_shutdown(self, hook: ShutdownHook) -> None:
+        """Хук выполняется после дренажа хендлеров (в порядке регистрации)."""
+        self._shutdown_hooks.append(hook)
+
+    def stop(self, sig: signal.Signals | None = None) -> None:
+        if sig is not None:
+            logger.warning("Received %s, stopping polling", sig.name)
+        self._stop.set()
+
+    def _install_signals(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            with suppress(NotImplementedError):  # Windows
+                loop.add_signal_handler(sig, self.stop, sig)
+
+    async def _handle(self, update_id: int, update: Update) -> None:
+        try:
+            await self.dp.feed_update(self.bot, update, dispatcher=self.dp, bots=(self.bot,))
+        except asyncio.CancelledError:
+            # не успели за DRAIN_TIMEOUT — апдейт остаётся pending и будет доигран
+            raise
+        except Exception:
+            logger.exception("Failed to process update id=%s", update_id)
+        # хендлер отработал — метку done дописываем даже при отмене, иначе апдейт доиграют дважды
+        mark = asyncio.ensure_future(db.mark_update_done(update_id))
+        try:
+            await asyncio.shield(mark)
+        except asyncio.CancelledError:
+            await mark
+            raise
+
+    def _dispatch(self, update_id: int, update: Update) -> None:
+        task = asyncio.create_task(self._handle(update_id, update), name=f"update-{update_id}")
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _keep_lease(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await db.renew_poller_lease(self.instance_id, time.time() + self.lease_ttl)
+            except Exception:
+                logger.exception("Failed to renew poller lease")
+
+    async def acquire_lease(self) -> str:
+        """Взять аренду процесса до старта воркеров (они claim'ят задачи от её имени)."""
+        if self._lease is None:
+            await db.renew_poller_lease(self.instance_id, time.time() + self.lease_ttl)
+            self._lease = asyncio.create_task(self._keep_lease(), name="poller-lease")
+        return self.instance_id
+
+    async def _drop_lease(self) -> None:
+        if self._lease is None:
+            return
+        self._lease.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._lease
+        self._lease = None
+        try:
+            await db.drop_poller_lease(self.instance_id)
+        except Exception:
+            logger.exception("Failed to drop poller lease, it will expire in %.0fs", self.lease_ttl)
+
+    async def _replay_pending(self) -> None:
+        pending = await db.claim_pending_updates(self.instance_id, time.time())
+        if pending:
+            logger.info("Replaying %s updates released by another instance", len(pending))
+        for update_id, body in pending:
+            self._dispatch(update_id, Update.model_validate_json(body, context={"bot": self.bot}))
+
+    async def _get_updates(self, offset: int | None, allowed_updates: list) -> list[Update] | None:
+        """Один long poll; None — если пришёл сигнал остановки."""
+        fetch = asyncio.create_task(self.bot.get_updates(
+            offset=offset, timeout=self.polling_timeout, allowed_updates=allowed_updates
+        ))
+        stop = asyncio.create_task(self._stop.wait())
+        try:
+            await asyncio.wait({fetch, stop}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop.cancel()
+        if not fetch.done():
+            # обрываем запрос: без нового offset Telegram ничего не подтвердит и отдаст это следующему
+            fetch.cancel()
+            with suppress(asyncio.CancelledError):
+                await fetch
+            return None
+        return fetch.result()
+
+    async def _poll(self) -> None:
+        stored = await db.get_state("polling_offset")
+        offset = int(stored) if stored else None
+        allowed_updates = self.dp.resolve_used_update_types()
+        delay = 1.0
+        adopted_at = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                updates = await self._get_updates(offset, allowed_updates)
+                if updates:
+                    next_offset = updates[-1].update_id + 1
+                    fresh = set(await db.journal_updates(
+                        [(u.update_id, u.model_dump_json(exclude_unset=True)) for u in updates],
+                        next_offset, self.instance_id,
+                    ))
+                    # offset двигаем только после записи в inbox: следующий getUpdates их подтвердит
+                    offset = next_offset
+                    for u in updates:
+                        if u.update_id in fresh:
+                            self._dispatch(u.update_id, u)
+                if updates is not None and time.monotonic() - adopted_at >= ADOPT_INTERVAL:
+                    # старый процесс мог только что закончить дренаж и отпустить свои апдейты
+                    adopted_at = time.monotonic()
+                    await self._replay_pending()
+            except TelegramConflictError:
+                # старый процесс ещё держит getUpdates — ждём, пока он отпустит
+                logger.info("Another instance is still polling, retrying in %.0fs", delay)
+                await self._sleep(delay)
+                delay = min(RETRY_DELAY_MAX, delay * 2)
+                continue
+            except TelegramRetryAfter as e:
+                await self._sleep(e.retry_after)
+                continue
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logger.warning("getUpdates failed: %s, retrying in %.0fs", e, delay)
+                await self._sleep(delay)
+                delay = min(RETRY_DELAY_MAX, delay * 2)
+                continue
+            except Exception:
+                # "database is locked", TelegramBadRequest и т.п. — не повод завершать процесс
+                logger.exception("Polling iteration failed, retrying in %.0fs", delay)
+                await self._sleep(delay)
+                delay = min(RETRY_DELAY_MAX, delay * 2)
+                continue
+            delay = 1.0
+
+    async def _sleep(self, delay: float) -> None:
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._stop.wait(), delay)
+
+    async def _drain(self) -> None:
+        if not self._in_flight:
+            return
+        logger.info("Draining %s in-flight updates (timeout %.0fs)", len(self._in_flight), self.drain_timeout)
+        _, pending = await asyncio.wait(set(self._in_flight), timeout=self.drain_timeout)
+        if pending:
+            logger.warning("%s updates did not finish in time, left for the next instance", len(pending))
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def run(self, handle_signals: bool = True, close_bot_session: bool = True) -> None:
+        if handle_signals:
+            self._install_signals()
+        self._stop.clear()
+        await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp, bots=(self.bot,))
+        await self.acquire_lease()
+        logger.info("Start polling as %s", self.instance_id)
+        try:
+            await self._replay_pending()
+            await self._poll()
+        finally:
+            logger.info("Polling stopped")
+            await self._drain()
+            try:
+                released = await db.release_updates(self.instance_id)
+                if released:
+                    logger.info("Released %s unfinished updates to the next instance", released)
+            except Exception:
+                logger.exception("Failed to release updates, they will be replayed after lease expiry")
+            for hook in self._shutdown_hooks:
+                try:
+                    await hook()
+                except Exception:
+                    logger.exception("Shutdown hook %r failed", hook)
+            await self._drop_lease()
+            try:
+                await self.dp.emit_shutdown(bot=self.bot, dispatcher=self.dp, bots=(self.bot,))
+            finally:
+                if close_bot_session:
+                    await self.bot.session.close()
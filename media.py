@@ -0,0 +1,96 @@
+# media.py
+# Отправка локальных файлов курса (обложки, материалы) с кэшем Telegram file_id.
+# Каждый файл загружается в Telegram один раз: полученный file_id хранится в таблице
+# media по sha256 содержимого и виду отправки (фото/документ), дальше отправляем уже по file_id.
+# Отправлять можно только файлы из MEDIA_DIR: путь задаёт админ, а материал уходит
+# каждому покупателю — .env или database.db сюда попасть не должны.
+import asyncio
+import hashlib
+import logging
+import os
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+import db
+
+logger = logging.getLogger(__name__)
+
+MEDIA_DIR = os.path.realpath(os.getenv("MEDIA_DIR", "media"))
+
+# path -> (mtime_ns, size, sha256), чтобы не перечитывать файл на каждую отправку
+_hash_cache: dict[str, tuple[int, int, str]] = {}
+
+
+def resolve(path: str) -> str | None:
+    """Абсолютный путь к файлу внутри MEDIA_DIR или None (нет файла / вне каталога).
+
+    Относительный путь считается от MEDIA_DIR; симлинки раскрываются до проверки.
+    """
+    real = os.path.realpath(os.path.join(MEDIA_DIR, path))
+    if os.path.commonpath([real, MEDIA_DIR]) != MEDIA_DIR or not os.path.isfile(real):
+        return None
+    return real
+
+
+def _file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+async def content_hash(path: str) -> str:
+    st = os.stat(path)
+    cached = _hash_cache.get(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    digest = await asyncio.to_thread(_file_hash, path)
+    _hash_cache[path] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+
+def _sent_file_id(kind: str, msg: Message) -> str | None:
+    if kind == "photo" and msg.photo:
+        return msg.photo[-1].file_id
+    if kind == "document" and msg.document:
+        return msg.document.file_id
+    return None
+
+
+def _is_bad_file_id(e: TelegramBadRequest) -> bool:
+    # "wrong file identifier", "wrong remote file identifier", "file reference expired" ...
+    return "file" in str(e).lower()
+
+
+async def _send(bot: Bot, kind: str, chat_id: int, path: str, **kwargs) -> Message:
+    send = bot.send_photo if kind == "photo" else bot.send_document
+    path = resolve(path)
+    if path is None:
+        raise ValueError(f"{kind} file is missing or outside MEDIA_DIR")
+    digest = await content_hash(path)
+    file_id = await db.get_media_file_id(digest, kind)
+    if file_id:
+        try:
+            return await send(chat_id, file_id, **kwargs)
+        except TelegramBadRequest as e:
+            if not _is_bad_file_id(e):
+                raise
+            # file_id протух (или от другого бота) — грузим заново
+            logger.warning("Cached file_id for %s is invalid (%s), re-uploading", path, e)
+            await db.delete_media(digest, kind)
+    msg = await send(chat_id, FSInputFile(path), **kwargs)
+    new_id = _sent_file_id(kind, msg)
+    if new_id:
+        await db.save_media_file_id(digest, kind, new_id, path)
+    return msg
+
+
+async def send_photo(bot: Bot, chat_id: int, path: str, **kwargs) -> Message:
+    return await _send(bot, "photo", chat_id, path, **kwargs)
+
+
+async def send_document(bot: Bot, chat_id: int, path: str, **kwargs) -> Message:
+    return await _send(bot, "document", chat_id, path, **kwargs)
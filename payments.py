@@ -0,0 +1,61 @@
+# payments.py
+# Покупка курса через Telegram Payments. Роутер подключается из Bot.py только
+# при заданном PAYMENT_PROVIDER_TOKEN; выдача курса после оплаты — задача deliver_course (tasks.py).
+import logging
+
+from aiogram import F, Router
+from aiogram.enums import ContentType
+from aiogram.types import CallbackQuery, LabeledPrice, Message, PreCheckoutQuery
+
+import config
+import db
+import jobs
+from helpers import extract_int
+
+logger = logging.getLogger(__name__)
+
+router = Router(name="payments")
+
+
+@router.callback_query(F.data.startswith("buy:"))
+async def on_buy(callback: CallbackQuery):
+    cid = extract_int(callback.data)
+    if cid is None:
+        await callback.answer("Ошибка покупки", show_alert=True)
+        return
+    course = await db.get_course(cid)
+    if not course:
+        await callback.answer("Курс не найден", show_alert=True)
+        return
+    price = int(course.get("price", 0) or 0)
+    if price <= 0:
+        await callback.answer("Неверная цена", show_alert=True)
+        return
+    prices = [LabeledPrice(label=course.get("title", "Курс"), amount=price * 100)]
+    try:
+        await callback.bot.send_invoice(
+            chat_id=callback.from_user.id,
+            title=course.get("title", "Курс"),
+            description=(course.get("description") or "")[:1000],
+            payload=f"course:{cid}",
+            provider_token=config.PAYMENT_PROVIDER_TOKEN,
+            currency="RUB",
+            prices=prices,
+            start_parameter=f"course_{cid}"
+        )
+    except Exception:
+        logger.exception("send_invoice failed")
+        await callback.message.answer("Не удалось отправить инвойс — проверьте PAYMENT_PROVIDER_TOKEN.")
+
+
+@router.pre_checkout_query()
+async def precheckout(query: PreCheckoutQuery):
+    await query.bot.answer_pre_checkout_query(query.id, ok=True)
+
+
+@router.message(F.content_type == ContentType.SUCCESSFUL_PAYMENT)
+async def on_successful_payment(message: Message):
+    payload = (message.successful_payment and message.successful_payment.invoice_payload) or ""
+    # выдача курса и прочие побочные эффекты — в фоне, Telegram ждать не должен
+    await jobs.enqueue("deliver_course", chat_id=message.chat.id, user_id=message.from_user.id, payload=payload)
+
@@ -0,0 +1,176 @@
+# profiler.py
+# Профилирование живого процесса по команде админа и детектор зависаний event loop.
+#
+# * ProfileSession: cProfile на N секунд или N апдейтов; итог — топ функций по
+#   cumulative time и сырой .prof файл (открывается snakeviz / pstats).
+# * StallWatchdog: фоновый поток следит за "пульсом" loop; если loop не отвечает
+#   дольше STALL_THRESHOLD, снимает стек потока loop — видно, кто его заблокировал.
+import asyncio
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SECONDS = int(os.getenv("PROFILE_SECONDS", "30") or 30)
+PROFILE_MAX_SECONDS = 600        # режим "N апдейтов" не должен висеть вечно
+PROFILE_TOP = 25
+STALL_THRESHOLD = float(os.getenv("STALL_THRESHOLD", "0.5") or 0.5)
+HEARTBEAT_INTERVAL = 0.1
+
+
+# ---------- cProfile session ----------
+class ProfileSession:
+    def __init__(self, seconds: int | None = None, updates: int | None = None):
+        if not updates and not (seconds and seconds > 0):
+            raise ValueError("Нужно задать длительность (секунды или апдейты) больше нуля")
+        self.seconds = min(seconds, PROFILE_MAX_SECONDS) if seconds else None
+        self.updates = updates
+        self.seen_updates = 0
+        self.started = 0.0
+        self._profile = cProfile.Profile()
+        self._updates_reached = asyncio.Event()
+
+    def describe(self) -> str:
+        return f"{self.updates} апдейтов" if self.updates else f"{self.seconds} с"
+
+    def note_update(self) -> None:
+        self.seen_updates += 1
+        if self.updates and self.seen_updates >= self.updates:
+            self._updates_reached.set()
+
+    async def run(self) -> tuple[str, bytes]:
+        """Профилировать и вернуть (текстовый отчёт, содержимое .prof)."""
+        self.started = time.perf_counter()
+        self._profile.enable()
+        try:
+            if self.updates:
+                try:
+                    await asyncio.wait_for(self._updates_reached.wait(), PROFILE_MAX_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(self.seconds)
+        finally:
+            self._profile.disable()
+        elapsed = time.perf_counter() - self.started
+        return await asyncio.to_thread(self._report, elapsed)
+
+    def _report(self, elapsed: float) -> tuple[str, bytes]:
+        # dump_stats пишет только в файл, а формат у него — marshal от stats;
+        # снимаем до pstats.Stats, который забирает stats себе и очищает профиль
+        self._profile.create_stats()
+        raw = marshal.dumps(self._profile.stats)
+        out = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=out)
+        stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP)
+        header = f"Профиль: {elapsed:.1f} с, апдейтов: {self.seen_updates}\n"
+        return header + out.getvalue(), raw
+
+
+_active: ProfileSession | None = None
+
+
+def active_session() -> ProfileSession | None:
+    return _active
+
+
+async def profile(seconds: int | None = None, updates: int | None = None) -> tuple[str, bytes]:
+    global _active
+    if _active is not None:
+        raise RuntimeError("Профилирование уже идёт")
+    _active = ProfileSession(seconds=seconds, updates=updates)
+    try:
+        return await _active.run()
+    finally:
+        _active = None
+
+
+class UpdateCounter(BaseMiddleware):
+    """Outer middleware на dp.update: считает апдейты для режима "N апдейтов"."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            if _active is not None:
+                _active.note_update()
+
+
+# ---------- event loop stall detector ----------
+class StallWatchdog:
+    def __init__(self, threshold: float = STALL_THRESHOLD, keep: int = 20):
+        self.threshold = threshold
+        self.stalls: deque = deque(maxlen=keep)
+        self._beat = time.monotonic()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._handle: asyncio.TimerHandle | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _heartbeat(self) -> None:
+        self._beat = time.monotonic()
+        self._handle = self._loop.call_later(HEARTBEAT_INTERVAL, self._heartbeat)
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat()
+        self._thread = threading.Thread(target=self._watch, name="loop-stall-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._handle:
+            self._handle.cancel()
+        if self._thread:
+            await asyncio.to_thread(self._thread.join, 1)
+
+    def _watch(self) -> None:
+        current = None  # запись о зависании, которое длится прямо сейчас
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            lag = time.monotonic() - self._beat - HEARTBEAT_INTERVAL
+            if lag >= self.threshold:
+                if current is None:
+                    frame = sys._current_frames().get(self._loop_thread_id)
+                    stack = "".join(traceback.format_stack(frame)) if frame else "<no frame>"
+                    current = {"at": time.time(), "blocked_for": lag, "stack": stack}
+                    self.stalls.append(current)
+                    logger.warning("Event loop blocked for %.2fs, stack:\n%s", lag, stack)
+                else:
+                    current["blocked_for"] = lag
+            elif current is not None:
+                current = None
+
+
+watchdog = StallWatchdog()
+
+
+def format_stalls(limit: int = 5) -> str:
+    if not watchdog.stalls:
+        return "Зависаний event loop не зафиксировано."
+    lines = []
+    for s in list(watchdog.stalls)[-limit:]:
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(s["at"]))
+        # последние кадры стека — то, что реально держало loop
+        tail = "".join(s["stack"].splitlines(keepends=True)[-8:])
+        lines.append(f"⏱ {stamp} — {s['blocked_for']:.2f} с\n{tail}")
+    return "\n".join(lines)
@@ -0,0 +1,149 @@
+# recommendations.py
+# "Похожие курсы" для страницы курса. Индекс курс -> курс считается заранее:
+# общая категория, пересечение слов в названии/описании и совместные покупки.
+# Пары хранятся в course_similarity (db.py) и держатся в памяти, так что
+# on_course_selected делает только lookup. При изменении курса пересчитываются
+# лишь его пары (refresh_course) по данным каталога из памяти и покупкам только
+# этого курса, полная пересборка — rebuild().
+import asyncio
+import logging
+import math
+import re
+
+from aiogram import Bot
+
+import db
+import jobs
+
+logger = logging.getLogger(__name__)
+
+W_CATEGORY = 0.4
+W_TEXT = 0.4
+W_COPURCHASE = 0.2
+MIN_SCORE = 0.05
+RELATED_LIMIT = 3
+
+_TERM_RE = re.compile(r"\w{4,}")
+
+# course_id -> {related_id: score}; симметрично
+_scores: dict[int, dict[int, float]] = {}
+# course_id -> [related_id, ...] лучшие RELATED_LIMIT по убыванию score
+_top: dict[int, list[int]] = {}
+# course_id -> (курс, его термы): каталог для refresh_course без чтения всех курсов
+_courses: dict[int, tuple[dict, set]] = {}
+_lock = asyncio.Lock()
+
+
+def _terms(course: dict) -> set:
+    text = f"{course.get('title') or ''} {course.get('description') or ''}".lower()
+    return set(_TERM_RE.findall(text))
+
+
+def _score(a: dict, b: dict, terms: dict, buyers: dict, co: dict) -> float:
+    score = 0.0
+    if a.get("category_id") is not None and a.get("category_id") == b.get("category_id"):
+        score += W_CATEGORY
+    ta, tb = terms[a["id"]], terms[b["id"]]
+    if ta and tb:
+        score += W_TEXT * len(ta & tb) / len(ta | tb)
+    both = co.get((min(a["id"], b["id"]), max(a["id"], b["id"])), 0)
+    if both:
+        # косинус по множествам покупателей
+        score += W_COPURCHASE * both / math.sqrt(buyers.get(a["id"], 1) * buyers.get(b["id"], 1))
+    return round(score, 4)
+
+
+def _update_top(course_id: int) -> None:
+    ranked = sorted(_scores.get(course_id, {}).items(), key=lambda kv: (-kv[1], kv[0]))
+    _top[course_id] = [rid for rid, _ in ranked[:RELATED_LIMIT]]
+
+
+def related(course_id: int) -> list[dict]:
+    """Похожие курсы из памяти: [{"id", "title"}, ...]."""
+    return [{"id": rid, "title": _courses[rid][0]["title"] if rid in _courses else "—"}
+            for rid in _top.get(course_id, [])]
+
+
+def _remember(courses: list) -> None:
+    _courses.clear()
+    _courses.update({c["id"]: (c, _terms(c)) for c in courses})
+
+
+async def load() -> None:
+    """Поднять индекс из SQLite; если его ещё нет — построить."""
+    courses = await db.get_all_courses()
+    rows = await db.get_similarities()
+    if courses and not rows:
+        await rebuild()
+        return
+    _scores.clear()
+    _top.clear()
+    _remember(courses)
+    for course_id, related_id, score in rows:
+        _scores.setdefault(course_id, {})[related_id] = score
+    for course_id in _scores:
+        _update_top(course_id)
+    logger.info("Recommendations index loaded: %s courses, %s pairs", len(_scores), len(rows))
+
+
+async def rebuild() -> None:
+    async with _lock:
+        courses = await db.get_all_courses()
+        buyers, co = await db.get_purchase_stats()
+        terms = {c["id"]: _terms(c) for c in courses}
+        scores: dict[int, dict[int, float]] = {}
+        rows = []
+        for i, a in enumerate(courses):
+            for b in courses[i + 1:]:
+                s = _score(a, b, terms, buyers, co)
+                if s >= MIN_SCORE:
+                    scores.setdefault(a["id"], {})[b["id"]] = s
+                    scores.setdefault(b["id"], {})[a["id"]] = s
+                    rows += [(a["id"], b["id"], s), (b["id"], a["id"], s)]
+        await db.replace_similarities(rows)
+        _scores.clear()
+        _scores.update(scores)
+        _remember(courses)
+        _top.clear()
+        for course_id in _scores:
+            _update_top(course_id)
+    logger.info("Recommendations index rebuilt: %s courses, %s pairs", len(courses), len(rows) // 2)
+
+
+async def refresh_course(course_id: int) -> None:
+    """Пересчитать пары одного курса (создан, изменён, удалён или куплен)."""
+    async with _lock:
+        course = await db.get_course(course_id)
+        affected = set(_scores.pop(course_id, {}))
+        for rid in affected:
+            _scores.get(rid, {}).pop(course_id, None)
+        _courses.pop(course_id, None)
+        _top.pop(course_id, None)
+        rows = []
+        if course is not None:
+            others = [c for c, _ in _courses.values()]
+            terms = {cid: t for cid, (_, t) in _courses.items()}
+            _courses[course_id] = (course, _terms(course))
+            terms[course_id] = _courses[course_id][1]
+            buyers, co = await db.get_course_purchase_stats(course_id)
+            mine = {}
+            for other in others:
+                s = _score(course, other, terms, buyers, co)
+                if s >= MIN_SCORE:
+                    mine[other["id"]] = s
+                    _scores.setdefault(other["id"], {})[course_id] = s
+                    rows += [(course_id, other["id"], s), (other["id"], course_id, s)]
+            _scores[course_id] = mine
+            affected |= set(mine)
+            _update_top(course_id)
+        await db.replace_similarities(rows, course_id=course_id)
+        for rid in affected:
+            _update_top(rid)
+
+
+@jobs.job("refresh_recommendations")
+async def job_refresh_recommendations(bot: Bot, course_id: int | None = None):
+    if course_id is None:
+        await rebuild()
+    else:
+        await refresh_course(course_id)
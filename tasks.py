@@ -0,0 +1,49 @@
+# tasks.py
+# Обработчики фоновых задач (jobs.py), которые ставят роутеры payments/admin.
+# Импортируется из Bot.py всегда: роутеры подключаются лениво и по конфигу, а задача,
+# оставшаяся в очереди от прошлого запуска, должна найти обработчик и без них.
+import logging
+
+from aiogram import Bot
+
+import db
+import jobs
+import media
+from helpers import extract_int
+
+logger = logging.getLogger(__name__)
+
+
+@jobs.job("deliver_course")
+async def job_deliver_course(bot: Bot, chat_id: int, payload: str, user_id: int | None = None):
+    cid = extract_int(payload)
+    if cid is None:
+        await bot.send_message(chat_id, "Оплата принята, но не удалось сопоставить курс.")
+        return
+    course = await db.get_course(cid)
+    if not course:
+        await bot.send_message(chat_id, "Оплата принята, курс не найден.")
+        return
+    # повтор задачи после сбоя отправки не должен записать покупку второй раз
+    if await db.add_purchase(user_id or chat_id, cid):
+        # совместные покупки меняют похожесть этого курса
+        await jobs.enqueue("refresh_recommendations", course_id=cid)
+    link = course.get("link") or ""
+    material = course.get("material")
+    if link:
+        await bot.send_message(chat_id, f"✅ Оплата прошла — вот ссылка на курс:\n{link}")
+    elif not material:
+        await bot.send_message(chat_id, "✅ Оплата прошла — но ссылка не установлена. Свяжитесь с админом.")
+    if material:
+        if media.resolve(material):
+            await media.send_document(bot, chat_id, material, caption=f"📎 Материалы курса «{course['title']}»")
+        else:
+            logger.error("Course %s material file is missing or outside MEDIA_DIR: %s", cid, material)
+            await bot.send_message(chat_id, "Материалы курса временно недоступны. Свяжитесь с админом.")
+
+
+@jobs.job("detach_category_courses")
+async def job_detach_category_courses(bot: Bot, category_id: int):
+    await db.detach_courses_from_category(category_id)
+    # у курсов сменилась категория — пересобираем индекс целиком
+    await jobs.enqueue("refresh_recommendations")
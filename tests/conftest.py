@@ -0,0 +1,7 @@
+# tests/conftest.py
+# Модули бота лежат в корне репозитория — делаем их импортируемыми из tests/.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "42:TEST")
@@ -0,0 +1,115 @@
+# tests/test_lifecycle.py
+# Передача апдейтов между процессами под нагрузкой. Два сценария: новый процесс
+# стартует после остановки старого и пока старый ещё работает/дренажит. Хендлер
+# делает побочный эффект до await, так что повторно выполненный апдейт (в том числе
+# отменённый и доигранный) виден как дубль.
+import asyncio
+import functools
+import os
+import random
+from collections import Counter
+from contextlib import suppress
+from datetime import datetime
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramConflictError
+from aiogram.methods import GetUpdates
+from aiogram.types import Chat, Message, Update
+
+import db
+from lifecycle import Poller
+
+
+class FakeTelegram:
+    """getUpdates с семантикой Bot API: всё, что ниже offset, считается подтверждённым,
+    а второй одновременный long poll получает 409 Conflict."""
+
+    def __init__(self):
+        self.updates: list[Update] = []
+        self.confirmed = 0
+        self.arrived = asyncio.Event()
+        self.holder: Bot | None = None
+
+    def push(self, update_id: int) -> None:
+        msg = Message(message_id=update_id, date=datetime.now(), chat=Chat(id=1, type="private"), text="load")
+        self.updates.append(Update(update_id=update_id, message=msg))
+        self.arrived.set()
+
+    async def get_updates(self, caller: Bot, offset=None, timeout=0, allowed_updates=None):
+        if self.holder is not None and self.holder is not caller:
+            raise TelegramConflictError(GetUpdates(), "Conflict: terminated by other getUpdates request")
+        self.holder = caller
+        try:
+            if offset is not None:
+                self.confirmed = max(self.confirmed, offset)
+            self.arrived.clear()
+            batch = [u for u in self.updates if u.update_id >= self.confirmed][:100]
+            if not batch:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.arrived.wait(), timeout)
+                batch = [u for u in self.updates if u.update_id >= self.confirmed][:100]
+            return batch
+        finally:
+            self.holder = None
+
+
+async def handoff(overlap: bool, total: int) -> Counter:
+    await db.create_tables()
+    telegram = FakeTelegram()
+    handled: Counter = Counter()
+
+    def make_instance() -> Poller:
+        bot = Bot(token="42:TEST")
+        bot.get_updates = functools.partial(telegram.get_updates, bot)
+        dp = Dispatcher()
+
+        @dp.message()
+        async def on_load(message: Message):
+            handled[message.message_id] += 1
+            await asyncio.sleep(random.uniform(0, 0.2))
+
+        # дренаж дольше хендлера: за отведённое время старый процесс всё доделывает сам
+        return Poller(bot, dp, polling_timeout=1, drain_timeout=1)
+
+    async def producer():
+        for i in range(1, total + 1):
+            telegram.push(i)
+            await asyncio.sleep(0.002)
+
+    feed = asyncio.create_task(producer())
+    old = make_instance()
+    old_run = asyncio.create_task(old.run(handle_signals=False))
+    await asyncio.sleep(0.3)
+    if overlap:
+        # новый стартует, пока старый ещё поллит; старого гасим посреди его работы
+        new = make_instance()
+        new_run = asyncio.create_task(new.run(handle_signals=False))
+        await asyncio.sleep(0.3)
+        old.stop()
+    else:
+        old.stop()  # SIGTERM посреди нагрузки
+        await old_run
+        new = make_instance()
+        new_run = asyncio.create_task(new.run(handle_signals=False))
+    await feed
+    await old_run
+    for _ in range(100):
+        if len(handled) >= total:
+            break
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(0.3)
+    new.stop()
+    await new_run
+    return handled
+
+
+@pytest.mark.parametrize("overlap", [False, True], ids=["sequential", "overlap"])
+def test_handoff_loses_and_duplicates_nothing(tmp_path, monkeypatch, overlap):
+    monkeypatch.setattr(db, "DB_PATH", os.path.join(tmp_path, "lifecycle.db"))
+    total = 300
+    handled = asyncio.run(handoff(overlap, total))
+    lost = set(range(1, total + 1)) - set(handled)
+    duplicated = sorted(i for i, n in handled.items() if n > 1)
+    assert not lost
+    assert not duplicated
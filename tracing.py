@@ -0,0 +1,212 @@
+# tracing.py
+# Неблокирующее структурированное логирование и спаны в духе distributed tracing.
+#
+# Логи из event loop только кладутся в очередь (QueueHandler), в stderr их пишет
+# фоновый поток QueueListener в виде JSON-строк. Каждому апдейту (и фоновой задаче)
+# выдаётся trace_id: он попадает во все записи лога, а вложенные спаны — хендлер,
+# вызовы db.py, запросы к Bot API — собираются с длительностями. Медленные трейсы
+# (дольше TRACE_SLOW_MS) пишутся в лог целиком, остальные — с вероятностью TRACE_SAMPLE_RATE.
+import contextvars
+import copy
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import traceback
+import uuid
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "500") or 500)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0") or 0)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+trace_logger = logging.getLogger("trace")
+
+_current_trace: contextvars.ContextVar["Trace | None"] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[int | None] = contextvars.ContextVar("current_span", default=None)
+
+
+class Trace:
+    def __init__(self, name: str, trace_id: str | None = None):
+        self.name = name
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.spans: list[dict] = []
+
+    def to_dict(self, duration_ms: float) -> dict:
+        return {"trace_id": self.trace_id, "name": self.name, "duration_ms": round(duration_ms, 2), "spans": self.spans}
+
+
+class span:
+    """Вложенный спан текущего трейса: with tracing.span("db.get_course", course_id=1): ...
+
+    Вне трейса ничего не записывает, так что безопасен в любом месте.
+    """
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self._trace = _current_trace.get()
+        if self._trace is None:
+            return self
+        self._record = {"id": len(self._trace.spans), "parent": _current_span.get(), "name": self.name}
+        if self.attrs:
+            self._record["attrs"] = self.attrs
+        self._trace.spans.append(self._record)
+        self._token = _current_span.set(self._record["id"])
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._trace is None:
+            return False
+        now = time.perf_counter()
+        self._record["start_ms"] = round((self._started - self._trace.started) * 1000, 2)
+        self._record["duration_ms"] = round((now - self._started) * 1000, 2)
+        if exc_type is not None:
+            self._record["error"] = exc_type.__name__
+        _current_span.reset(self._token)
+        return False
+
+
+class trace:
+    """Корневой спан на время обработки апдейта / задачи.
+
+    trace_id — продолжить чужой трейс (задача из очереди несёт id апдейта, который её
+    поставил), иначе выдаётся новый.
+    """
+
+    def __init__(self, name: str, trace_id: str | None = None, **attrs):
+        self.name = name
+        self.trace_id = trace_id
+        self.attrs = attrs
+
+    def __enter__(self) -> Trace:
+        self._trace = Trace(self.name, trace_id=self.trace_id)
+        self._trace_token = _current_trace.set(self._trace)
+        self._span_token = _current_span.set(None)
+        self._root = span(self.name, **self.attrs).__enter__()
+        return self._trace
+
+    def __exit__(self, exc_type, exc, tb):
+        self._root.__exit__(exc_type, exc, tb)
+        duration_ms = (time.perf_counter() - self._trace.started) * 1000
+        if duration_ms >= TRACE_SLOW_MS:
+            trace_logger.warning("slow trace %s %.0fms", self.name, duration_ms,
+                                 extra={"trace": self._trace.to_dict(duration_ms)})
+        elif TRACE_SAMPLE_RATE and random.random() < TRACE_SAMPLE_RATE:
+            trace_logger.info("sampled trace %s %.0fms", self.name, duration_ms,
+                              extra={"trace": self._trace.to_dict(duration_ms)})
+        _current_span.reset(self._span_token)
+        _current_trace.reset(self._trace_token)
+        return False
+
+
+def current_trace_id() -> str | None:
+    t = _current_trace.get()
+    return t.trace_id if t else None
+
+
+def traced(func: Callable[..., Awaitable[Any]]):
+    """Декоратор для корутин: обернуть вызов в спан "<module>.<function>"."""
+    name = f"{func.__module__}.{func.__name__}"
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with span(name):
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+# ---------- aiogram integration ----------
+class TraceMiddleware(BaseMiddleware):
+    """Outer middleware на dp.update: трейс на каждый апдейт."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        with trace(f"update:{event.event_type}", update_id=event.update_id):
+            return await handler(event, data)
+
+
+class TraceRequestMiddleware(BaseRequestMiddleware):
+    """Спан на каждый исходящий запрос к Bot API: bot.session.middleware(TraceRequestMiddleware())."""
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"bot.{method.__api_method__}"):
+            return await make_request(bot, method)
+
+
+# ---------- logging ----------
+class _TraceIdFilter(logging.Filter):
+    # выполняется в потоке/контексте вызывающего, до попадания записи в очередь
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+        if getattr(record, "trace", None):
+            entry["trace"] = record.trace
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        elif record.exc_info:
+            entry["exc"] = "".join(traceback.format_exception(*record.exc_info))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # стандартный prepare вклеивает трейсбек в msg — нам он нужен отдельным полем exc
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: str = LOG_LEVEL) -> logging.handlers.QueueListener:
+    """Повесить на root неблокирующий QueueHandler и запустить фоновый writer.
+
+    Возвращает listener — его нужно остановить при завершении (listener.stop() дописывает очередь).
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(_TraceIdFilter())
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(handler)
+    root.setLevel(level)
+    listener.start()
+    return listener